@@ -4,11 +4,21 @@ and creating popups for desired map layers
 """
 
 # import modules
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from arcgis.gis import GIS
 from arcgis.mapping import WebMap
 
-# create connection to ArcGIS Enterprise/Portal
-PORTAL_CONNECTION = GIS("portal_url", "username", "password")
+# connection to ArcGIS Enterprise/Portal and its user, created on first use
+PORTAL_CONNECTION = None
+PORTAL_USERNAME = None
+PORTAL_LOCK = threading.RLock()
+
+# marks arguments that are not given, as None is a valid data of feature services
+_NOT_GIVEN = object()
 
 
 def create_new_webmap(project_name, layer_names, *args):
@@ -35,22 +45,30 @@ def create_new_webmap(project_name, layer_names, *args):
         if not isinstance(layer_name, str):
             raise TypeError('expected layer name to be type of str')
 
+    # search portal items of the project at once
+    project_items = get_project_items(project_name)
+
     # get feature layers collection and update its properties
-    feature_layers = get_feature_layers_collection(project_name)
+    feature_layers = get_feature_layers_collection(project_name, project_items)
     feature_layers_properties = get_properties_from_project(
         project_name=project_name,
         content_type='Feature Layer',
         project_additional_info=list(args)
     )
-    feature_layers.update(item_properties=feature_layers_properties)
-    protect_share_item(feature_layers)
+    # read layers and data of feature layers collection before it is updated,
+    # so popups do not access the item while it is being updated;
+    # data is only needed for popups
+    layers = feature_layers.layers
+    feature_layer_data = None
+    if layer_names:
+        feature_layer_data = feature_layers.get_data()
 
     # create a new web map
     new_web_map = WebMap()
     print('creating a new web map')
 
     # add feature layers to the web map
-    for feature_layer in feature_layers.layers:
+    for feature_layer in layers:
         new_web_map.add_layer(layer=feature_layer)
     print('adding', feature_layers.title, 'to web map')
 
@@ -61,26 +79,85 @@ def create_new_webmap(project_name, layer_names, *args):
         project_additional_info=list(args)
     )
 
-    # create popups for map layers
-    create_popups(
-        web_map=new_web_map,
-        project_name=project_name,
-        layer_names=layer_names
-    )
+    # update is independent of popups, so it runs in the background
+    # while popups are created
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        feature_layers_update = executor.submit(
+            update_protect_share_item,
+            portal_item=feature_layers,
+            item_properties=feature_layers_properties
+        )
+        try:
+            # create popups for map layers
+            create_popups(
+                web_map=new_web_map,
+                project_name=project_name,
+                layer_names=layer_names,
+                layers=layers,
+                feature_layer_data=feature_layer_data
+            )
+        finally:
+            # wait for feature layers collection to be updated
+            feature_layers_update.result()
 
     # save the web map
     new_web_map.save(item_properties=web_map_properties)
     print('saving web map in portal')
 
 
-def get_portal_item(portal_connection, item_name, item_type):
+async def acreate_new_webmap(project_name, layer_names, *args):
+    """
+    creates a web map the same way as create_new_webmap
+    without blocking the event loop, so web maps of several
+    projects can be created concurrently with asyncio.gather
+
+    Args:
+        project_name (str): name of project
+        layer_names (list): list of layer names to be added to web map
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, create_new_webmap, project_name, layer_names, *args)
+
+
+def get_portal_connection():
+    """
+    creates connection to ArcGIS Enterprise/Portal
+    on first use and reuses it afterwards;
+    concurrent first calls sign in only once
+
+    Returns:
+        portal_connection (arcgis.gis.GIS): connection to the portal
+    """
+    global PORTAL_CONNECTION
+    with PORTAL_LOCK:
+        if PORTAL_CONNECTION is None:
+            PORTAL_CONNECTION = GIS("portal_url", "username", "password")
+
+    return PORTAL_CONNECTION
+
+
+def get_portal_username():
+    """
+    gets username of the signed in portal user
+
+    Returns:
+        username (str): name of the portal user
+    """
+    global PORTAL_USERNAME
+    with PORTAL_LOCK:
+        if PORTAL_USERNAME is None:
+            PORTAL_USERNAME = get_portal_connection().users.me.username
+
+    return PORTAL_USERNAME
+
+
+def get_portal_item(item_name, item_type):
     """
     gets portal items, including feature layers collections,
     map image layers, and vector tile packages
     in ArcGIS Enterprise/Portal
 
     Args:
-        portal_connection
         item_name (str): name of an item
         item_type (str): type of an item
 
@@ -91,8 +168,9 @@ def get_portal_item(portal_connection, item_name, item_type):
         KeyError: if the specified search item is not found
         KeyError: if the specified portal item is not found
     """
+    portal_connection = get_portal_connection()
     search_item = portal_connection.content.search(
-        query='title:{} AND owner:{}'.format(item_name, portal_connection.users.me.username),
+        query='title:{} AND owner:{}'.format(item_name, get_portal_username()),
         item_type=item_type
     )
 
@@ -109,20 +187,48 @@ def get_portal_item(portal_connection, item_name, item_type):
     return portal_item
 
 
-def get_feature_layers_collection(project_name):
+def get_project_items(project_name, max_items=100):
+    """
+    searches feature services of a project with a single query
+
+    Args:
+        project_name (str): name of project
+        max_items (int): maximum number of items to be found
+
+    Returns:
+        project_items (dict): portal items of the project, keyed by item title and type
+    """
+    search_items = get_portal_connection().content.search(
+        query='title:{}_* AND owner:{}'.format(project_name, get_portal_username()),
+        item_type='Feature Service',
+        max_items=max_items
+    )
+    print('finding', len(search_items), 'portal items of', project_name, 'project')
+
+    return {(item.title, item.type): item for item in search_items}
+
+
+def get_feature_layers_collection(project_name, project_items=None):
     """
     gets feature layers collection of a project
     in ArcGIS Enterprise/Portal
 
     Args:
        project_name (str): project name
+       project_items (dict): portal items of the project, keyed by item title and type;
+           the portal is searched if the item is not among them
 
     Returns:
         feature_layer_collection or feature service (arcgis.gis.Item)
     """
+    item_name = "{}_Map".format(project_name)
+
+    # feature layers collections are "Feature Service" items on the portal
+    if project_items and (item_name, "Feature Service") in project_items:
+        return project_items[(item_name, "Feature Service")]
+
     feature_layers_collection = get_portal_item(
-        portal_connection=PORTAL_CONNECTION,
-        item_name="{}_Map".format(project_name),
+        item_name=item_name,
         item_type="Feature Layer"
     )
 
@@ -148,17 +254,16 @@ def get_properties_from_project(project_name, content_type, project_additional_i
     item_tags = [project_name] + project_additional_info
     item_snippet = ('This is a {} of {} project.').format(content_type, project_name)
 
-    font_properties = '''<font color='#8b0000' size='4'><font style='font-family: inherit;'>'''
     item_description = (
         'This is a {} of {} project.').format(content_type, project_name)
 
     properties = {
         "title": item_title,
         "snippet": item_snippet,
-        "description": font_properties + item_description,
+        "description": ITEM_FONT_PROPERTIES + item_description,
         "tags": item_tags,
         "accessInformation": access_information,
-        "licenseInfo": font_properties + license_info
+        "licenseInfo": ITEM_FONT_PROPERTIES + license_info
     }
 
     if content_type != 'WebMap':
@@ -186,7 +291,20 @@ def protect_share_item(portal_item):
     print('sharing', portal_item.title, 'in organization')
 
 
-def create_popups(web_map, project_name, layer_names):
+def update_protect_share_item(portal_item, item_properties):
+    """
+    updates properties of a portal item, then
+    protects it from deletion and shares it in organization
+
+    Args:
+        portal_item (arcgis.gis.item)
+        item_properties (dict): properties of a portal item
+    """
+    portal_item.update(item_properties=item_properties)
+    protect_share_item(portal_item)
+
+
+def create_popups(web_map, project_name, layer_names, layers, feature_layer_data):
     """
     creates popups for web map operational layers
 
@@ -194,21 +312,42 @@ def create_popups(web_map, project_name, layer_names):
         web_map (arcgis.gis.Item)
         project_name (str): name of project
         layer_names (list): list of layer names to have popups
+        layers (list): layers of feature layers collection of the project
+        feature_layer_data (dict): data of feature layers collection of the project
     """
     if layer_names:
+        # web map definition is built on each access, so read it once;
+        # its operational layers are updated in place by popups
+        web_map_definition = web_map.definition
+
+        # index operational layers and feature layers by name once for all popups
+        operational_layers = {
+            layer['title']: layer for layer in web_map_definition['operationalLayers']
+        }
+        layer_indexes = {
+            layer.properties.name: index for index, layer in enumerate(layers)
+        }
+
+        map_service_name = '{}_{}'.format(project_name, 'Map')
+
         for layer_name in layer_names:
             # popup
             feature_layer_popup(
-                map_service_name='{}_{}'.format(project_name, 'Map'),
+                map_service_name=map_service_name,
                 map_service_type='Feature Layer',
-                web_map=web_map,
-                layer_name=layer_name
+                operational_layers=operational_layers,
+                layer_indexes=layer_indexes,
+                layer_name=layer_name,
+                layers=layers,
+                feature_layer_data=feature_layer_data
             )
     else:
         print('No popup was defined for layers')
 
 
-def feature_layer_popup(map_service_name, map_service_type, web_map, layer_name):
+def feature_layer_popup(map_service_name, map_service_type,
+                        operational_layers, layer_indexes, layer_name,
+                        layers=_NOT_GIVEN, feature_layer_data=_NOT_GIVEN):
     """
     includes all steps to create and customize
     popups for both registered and hosted feature layers in a web map
@@ -216,31 +355,40 @@ def feature_layer_popup(map_service_name, map_service_type, web_map, layer_name)
     Args:
         map_service_name (str): name of feature layers on the portal
         map_service_type (str): type of feature layers on the portal
-        web_map (ArcGIS item): created web map
+        operational_layers (dict): operational layers of the web map, keyed by title
+        layer_indexes (dict): indexes of layers in feature layers, keyed by layer name
         layer_name (str): name of each layer in a service
+        layers (list): layers of feature layers collection
+        feature_layer_data (dict): data of feature layers collection;
+            feature layers collection is searched on the portal if layers or data is not given
     """
-    # get operational layer of a web map
-    operational_layer = get_webmap_operational_layers(
-        web_map=web_map,
-        layer_name=layer_name
-    )
+    # get operational layer of a web map by its title,
+    # falling back to a partial match of titles
+    operational_layer = operational_layers.get(layer_name)
+    if operational_layer is None:
+        operational_layer = get_webmap_operational_layers(
+            operational_layers=operational_layers.values(),
+            layer_name=layer_name
+        )
     # get feature layer from feature layer collection
     target_layer = get_feature_layer_from_feature_service(
         map_service_name=map_service_name,
         map_service_type=map_service_type,
-        layer_name=layer_name
+        layer_indexes=layer_indexes,
+        layer_name=layer_name,
+        layers=layers,
+        feature_layer_data=feature_layer_data
     )
 
     # set popup info for the operational layer based on the type of services
     # hosted feature layer
-    if operational_layer['popupInfo']:
-        operational_layer_popup = operational_layer['popupInfo']
+    operational_layer_popup = operational_layer['popupInfo']
 
     # registered feature layer
-    else:
+    if not operational_layer_popup:
         # set popup info
-        operational_layer.update(popupInfo=target_layer['popupInfo'])
-        operational_layer_popup = operational_layer['popupInfo']
+        operational_layer_popup = target_layer['popupInfo']
+        operational_layer['popupInfo'] = operational_layer_popup
 
     # set title for popup
     operational_layer_popup['title'] = layer_name
@@ -253,14 +401,11 @@ def feature_layer_popup(map_service_name, map_service_type, web_map, layer_name)
     operational_layer_popup['description'] = layer_popup_description
 
     # set decimal places and digit separators for numeric fields
+    field_types = {fld.name: fld.type for fld in target_layer.properties.fields}
     for field in operational_layer_popup['fieldInfos']:
-        for fld in target_layer.properties.fields:
-            # double
-            if field['fieldName'] == fld.name and fld.type == "esriFieldTypeDouble":
-                field.update({"format": {"places": 2, "digitSeparator": False}})
-            # integer
-            elif field['fieldName'] == fld.name and fld.type == "esriFieldTypeInteger":
-                field.update({"format": {"places": 0, "digitSeparator": False}})
+        field_format = NUMERIC_FIELD_FORMATS.get(field_types.get(field['fieldName']))
+        if field_format:
+            field['format'] = dict(field_format)
 
     print('customizing popup for', operational_layer['title'])
 
@@ -277,54 +422,64 @@ def customize_popup_description(operational_layer, map_service_type):
     Returns:
         layer_popup_description (str): customized description for popup
     """
-    layer_popup_description = '''<font color='#dc143c' face='Arial' size='2'>'''
-
-    if map_service_type == 'Feature Layer':
-        operational_layer_popup = operational_layer['popupInfo']
-        for field in operational_layer_popup['fieldInfos']:
-
-            # registered feature layers
-            if any(letter.isupper() for letter in field['fieldName']) \
-                    and not field['fieldName'] in NO_POPUP_FIELDS:
-                field_name = split_uppercase(field['fieldName'])
-                field_popup = '<b> %s :</b>  {%s}  <br /><br />' % (field_name, field['fieldName'])
-                layer_popup_description += field_popup
-
-            # hosted feature layers
-            elif any(letter.isupper() for letter in field['label']) \
-                    and not field['label'] in NO_POPUP_FIELDS:
-                label = split_uppercase(field['label'])
-                field_popup = '<b> %s :</b>  {%s}  <br /><br />' % (label, field['label'])
-                layer_popup_description += field_popup
+    # only fields of feature layers are described in popups
+    if map_service_type != 'Feature Layer':
+        return ''
+
+    layer_popup_description = [POPUP_FONT_PROPERTIES]
+    for field in operational_layer['popupInfo']['fieldInfos']:
+        field_name = field['fieldName']
+
+        # registered feature layers
+        if field_name != field_name.lower() and field_name not in NO_POPUP_FIELDS:
+            layer_popup_description.append(
+                f'<b> {split_uppercase(field_name)} :</b>  {{{field_name}}}  <br /><br />')
+            continue
+
+        # hosted feature layers
+        label = field['label']
+        if label != label.lower() and label not in NO_POPUP_FIELDS:
+            layer_popup_description.append(
+                f'<b> {split_uppercase(label)} :</b>  {{{label}}}  <br /><br />')
 
     print('customizing popup description for', operational_layer['title'])
 
-    return layer_popup_description
+    return ''.join(layer_popup_description)
 
 
-def get_feature_layer_from_feature_service(map_service_name, map_service_type, layer_name):
+def get_feature_layer_from_feature_service(map_service_name, map_service_type,
+                                           layer_indexes, layer_name,
+                                           layers=_NOT_GIVEN, feature_layer_data=_NOT_GIVEN):
     """
     gets a feature layer in feature layer collection
 
     Args:
         map_service_name (str): name of feature layers on the portal
         map_service_type (str): type of feature layers on the portal
+        layer_indexes (dict): indexes of layers in feature layers, keyed by layer name
         layer_name (str): name of each layer in a service
+        layers (list): layers of feature layers collection
+        feature_layer_data (dict): data of feature layers collection;
+            feature layers collection is searched on the portal if layers or data is not given
     """
     # access a feature service and gets its data
-    feature_layers = get_portal_item(
-        portal_connection=PORTAL_CONNECTION,
-        item_name=map_service_name,
-        item_type=map_service_type
-    )
-    feature_layer_data = feature_layers.get_data()
-
-    # get index of a feature layer
-    layer_index = get_feature_layer_index(feature_layers, layer_name)
+    if layers is _NOT_GIVEN or feature_layer_data is _NOT_GIVEN:
+        feature_layers = get_portal_item(
+            item_name=map_service_name,
+            item_type=map_service_type
+        )
+        layers = feature_layers.layers
+        feature_layer_data = feature_layers.get_data()
+
+    # get index of a feature layer by its name,
+    # falling back to a partial match of layer names
+    layer_index = layer_indexes.get(layer_name)
+    if layer_index is None:
+        layer_index = get_feature_layer_index(layers, layer_name)
 
     if not feature_layer_data:
         # get target layer in hosted feature service
-        target_layer = feature_layers.layers[layer_index]
+        target_layer = layers[layer_index]
     else:
         # get target layer in registered feature service
         target_layer = feature_layer_data['layers'][layer_index]
@@ -332,66 +487,79 @@ def get_feature_layer_from_feature_service(map_service_name, map_service_type, l
     return target_layer
 
 
-def get_feature_layer_index(feature_layer_collection, layer_name):
+def get_feature_layer_index(layers, layer_name):
     """
     gets index of layers in a feature layer collection
 
     Args:
-        feature_layer_collection (arcgis.gis.item): published feature layers
+        layers (list): layers of published feature layers
         layer_name (str): name of desired layer
 
     Returns:
         layer_index (int): index of a layer in a feature layer collection
+
+    Raises:
+        KeyError: if the specified layer is not found
     """
-    for index, url in zip(range(len(feature_layer_collection.layers)),
-                          feature_layer_collection.layers):
-        if layer_name in feature_layer_collection.layers[index].properties.name:
-            layer_index = index
-            print('index of feature layer',
-                  feature_layer_collection.layers[layer_index].properties.name, 'with url of',
-                  url, 'is', layer_index)
+    for layer_index, layer in enumerate(layers):
+        if layer_name in layer.properties.name:
+            return layer_index
 
-    return layer_index
+    raise KeyError('unable to find layer {}'.format(layer_name))
 
 
-def get_webmap_operational_layers(web_map, layer_name):
+def get_webmap_operational_layers(operational_layers, layer_name):
     """
     gets operational layers of a web map
 
     Args:
-        web map (arcgis item)
+        operational_layers (iterable): operational layers of a web map definition
         layer_name (str): name of a layer
 
     Returns:
         operational_layer (dict): operational layer of web map, map property
+
+    Raises:
+        KeyError: if the specified operational layer is not found
     """
-    web_map_definition = web_map.definition
-    for layer in web_map_definition['operationalLayers']:
-        if layer_name in layer['title']:
-            operational_layer = layer
+    for operational_layer in operational_layers:
+        if layer_name in operational_layer['title']:
+            return operational_layer
 
-    return operational_layer
+    raise KeyError('unable to find operational layer {}'.format(layer_name))
 
 
 def split_uppercase(word):
     """
-    splits strings that have uppercase
+    splits strings that have uppercase;
+    only ASCII uppercase letters start a new word
 
     Args:
         word (str): a word to be splitted
     """
-    final_word = ''
-    for i in word:
-        final_word += ' %s' % i if i.isupper() else i
-
-    return final_word.strip()
+    return UPPERCASE_LETTER_PATTERN.sub(' ', word).strip()
 
 
-# list of fields that are not shown in popups of layers
-NO_POPUP_FIELDS = [
+# set of fields that are not shown in popups of layers
+NO_POPUP_FIELDS = frozenset({
     'OBJECTID', 'ORIG_FID', 'ORIG_FID_1', 'Shape.STArea()',
     'Shape.STLength()', 'Shape__Area', 'Shape__lenght', 'Shape'
-]
+})
+
+# HTML font of descriptions and license information of portal items
+ITEM_FONT_PROPERTIES = "<font color='#8b0000' size='4'><font style='font-family: inherit;'>"
+
+# HTML font of popup descriptions
+POPUP_FONT_PROPERTIES = "<font color='#dc143c' face='Arial' size='2'>"
+
+# popup formats of numeric fields, keyed by field type
+NUMERIC_FIELD_FORMATS = {
+    "esriFieldTypeDouble": {"places": 2, "digitSeparator": False},
+    "esriFieldTypeInteger": {"places": 0, "digitSeparator": False}
+}
+
+# position before each ASCII uppercase letter, except at the start of a word
+UPPERCASE_LETTER_PATTERN = re.compile(r'(?<!^)(?=[A-Z])')
 
 if __name__ == "__main__":
     create_new_webmap("project_name", ['layer_one', 'layer_two'])